@@ -1,19 +1,36 @@
 """FastAPI application for LocalForge offline AI services."""
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from config import settings
 from embeddings import get_embedder
-from llm import generate_completion
+from llm import close_client, generate_completion, stream_completion
 from vector_store import Document, VectorStore
 
+INDEX_READ_WORKERS = 16
+INDEX_ENCODE_CHUNK = 256
+INDEX_CHUNK_TOKENS = 256
+INDEX_CHUNK_OVERLAP = 32
+# File reads kept in flight ahead of the chunker, bounding how much text is
+# held in memory at once.
+INDEX_READ_AHEAD = 2 * INDEX_ENCODE_CHUNK
+
 app = FastAPI(title="LocalForge Backend", version="0.1.0")
 app.add_middleware(
     CORSMiddleware,
@@ -24,6 +41,29 @@ app.add_middleware(
 
 embedder = get_embedder()
 vector_store = VectorStore(settings.db_path)
+# Encoding runs on worker threads (request offload and the index pool), so a
+# thread semaphore bounds concurrent model calls on every path.
+_inference_slots = threading.BoundedSemaphore(settings.inference_concurrency)
+
+
+def _encode(texts: list[str]) -> np.ndarray:
+    """Embed texts while holding one of the inference slots."""
+
+    with _inference_slots:
+        return embedder.encode(texts)
+
+
+@lru_cache(maxsize=1024)
+def _encode_query(text: str) -> bytes:
+    """Embed a query string, caching repeats of identical queries."""
+
+    return _encode([text])[0].astype(np.float32).tobytes()
+
+
+def _query_embedding(text: str) -> np.ndarray:
+    """Return the cached embedding of a query as a float32 vector."""
+
+    return np.frombuffer(_encode_query(text), dtype=np.float32)
 
 
 class AddItem(BaseModel):
@@ -69,6 +109,14 @@ def _auto_index() -> None:
         _index_path(settings.auto_index_path, [".py", ".js", ".ts", ".md", ".txt"])
 
 
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    """Release the Ollama client and the vector store connection."""
+
+    await close_client()
+    vector_store.close()
+
+
 @app.get("/health")
 def health() -> dict[str, str]:
     """Simple health check endpoint."""
@@ -77,40 +125,31 @@ def health() -> dict[str, str]:
 
 
 @app.post("/add-batch")
-def add_batch(request: AddBatchRequest) -> dict[str, int]:
+async def add_batch(request: AddBatchRequest) -> dict[str, int]:
     """Add multiple documents to the vector store."""
 
-    texts = [item.content for item in request.items]
-    embeddings = embedder.encode(texts)
-    documents = []
-    for item, embedding in zip(request.items, embeddings):
-        documents.append(
-            Document(
-                doc_id=item.doc_id,
-                content=item.content,
-                metadata=item.metadata,
-                embedding=embedding,
-            )
-        )
-    count = vector_store.upsert_documents(documents)
+    count = await asyncio.to_thread(_index_items, request.items)
     return {"indexed": count}
 
 
+def _search(query: str, top_k: int) -> list[dict]:
+    """Embed a query and return its nearest documents."""
+
+    return vector_store.search(_query_embedding(query), top_k=top_k)
+
+
 @app.post("/search")
-def search(request: SearchRequest) -> dict[str, Any]:
+async def search(request: SearchRequest) -> dict[str, Any]:
     """Search indexed documents using embedding similarity."""
 
-    query_embedding = embedder.encode([request.query])
-    results = vector_store.search(query_embedding, top_k=request.top_k)
+    results = await asyncio.to_thread(_search, request.query, request.top_k)
     return {"results": results}
 
 
-@app.post("/query")
-def query(request: QueryRequest) -> dict[str, Any]:
-    """Query the local LLM with retrieved context."""
+def _build_prompt(request: QueryRequest) -> tuple[str, list[dict]]:
+    """Retrieve context for a query and build the LLM prompt from it."""
 
-    query_embedding = embedder.encode([request.query])
-    results = vector_store.search(query_embedding, top_k=request.top_k)
+    results = _search(request.query, request.top_k)
     context_blocks = "\n\n".join(
         f"Source: {item['id']}\n{item['content']}" for item in results
     )
@@ -120,47 +159,51 @@ def query(request: QueryRequest) -> dict[str, Any]:
         f"Context:\n{context_blocks}\n\n"
         f"Question: {request.query}\nAnswer:"
     )
-    response = generate_completion(prompt)
+    return prompt, results
+
+
+@app.post("/query")
+async def query(request: QueryRequest) -> dict[str, Any]:
+    """Query the local LLM with retrieved context."""
+
+    prompt, results = await asyncio.to_thread(_build_prompt, request)
+    response = await generate_completion(prompt)
     return {"response": response, "context": results}
 
 
+@app.post("/query-stream")
+async def query_stream(request: QueryRequest) -> StreamingResponse:
+    """Query the local LLM with retrieved context, streaming the answer as text."""
+
+    prompt, _ = await asyncio.to_thread(_build_prompt, request)
+    return StreamingResponse(stream_completion(prompt), media_type="text/plain")
+
+
 @app.post("/index")
-def index_path(request: IndexRequest) -> dict[str, int]:
+async def index_path(request: IndexRequest) -> dict[str, int]:
     """Index files from a local path on the backend host."""
 
     if not os.path.exists(request.path):
         raise HTTPException(status_code=404, detail="Path not found")
-    count = _index_path(request.path, request.extensions)
+    count = await asyncio.to_thread(_index_path, request.path, request.extensions)
     return {"indexed": count}
 
 
-def _index_path(path: str, extensions: list[str]) -> int:
-    """Index all supported files from a path."""
+def _read_file(file: Path) -> str | None:
+    """Read a source file as text, returning None when it cannot be read."""
 
-    root = Path(path)
-    files = [
-        file
-        for file in root.rglob("*")
-        if file.is_file() and file.suffix.lower() in extensions
-    ]
-    if not files:
+    try:
+        return file.read_text(encoding="utf-8", errors="ignore")
+    except OSError:
+        return None
+
+
+def _index_items(items: list[AddItem]) -> int:
+    """Embed and store a batch of items."""
+
+    if not items:
         return 0
-    contents = []
-    items = []
-    for file in files:
-        try:
-            content = file.read_text(encoding="utf-8", errors="ignore")
-        except OSError:
-            continue
-        contents.append(content)
-        items.append(
-            AddItem(
-                doc_id=str(file),
-                content=content,
-                metadata={"path": str(file), "extension": file.suffix.lower()},
-            )
-        )
-    embeddings = embedder.encode(contents)
+    embeddings = _encode([item.content for item in items])
     documents = []
     for item, embedding in zip(items, embeddings):
         documents.append(
@@ -172,3 +215,101 @@ def _index_path(path: str, extensions: list[str]) -> int:
             )
         )
     return vector_store.upsert_documents(documents)
+
+
+def _replace_files(paths: list[str], items: list[AddItem]) -> int:
+    """Drop the previous documents of re-chunked files, then store new chunks."""
+
+    vector_store.delete_by_path(paths)
+    return _index_items(items)
+
+
+def _index_path(path: str, extensions: list[str]) -> int:
+    """Index new or changed files from a path, one document per chunk.
+
+    Documents of files that changed or disappeared since the last run are
+    removed first.
+    """
+
+    # Ids and file states use absolute paths, so the removal pass below only
+    # ever compares paths recorded under this root in the same form.
+    root = Path(os.path.abspath(path))
+    files = [
+        file
+        for file in root.rglob("*")
+        if file.is_file() and file.suffix.lower() in extensions
+    ]
+    # Files indexed under this root before but no longer found are dropped.
+    prefix = os.path.join(str(root), "")
+    found = {str(file) for file in files}
+    removed = [
+        recorded
+        for recorded in vector_store.get_file_paths(prefix)
+        if recorded not in found and Path(recorded).suffix.lower() in extensions
+    ]
+    if removed:
+        vector_store.delete_by_path(removed)
+    # Files whose mtime has not advanced since they were last indexed are
+    # skipped without being read.
+    states = vector_store.get_file_states([str(file) for file in files])
+    pending = []
+    for file in files:
+        try:
+            mtime = file.stat().st_mtime
+        except OSError:
+            continue
+        state = states.get(str(file))
+        if state is None or mtime > state[0]:
+            pending.append((file, mtime))
+    count = 0
+    items: list[AddItem] = []
+    # Changed files whose old chunks are deleted with the next stored batch,
+    # so a file that shrank does not keep serving its trailing chunks.
+    replaced_paths: list[str] = []
+    indexed_states: list[tuple[str, float, str]] = []
+    # A sliding window of reads keeps the pool loading later files while
+    # earlier chunks are embedded, without holding every file in memory.
+    with ThreadPoolExecutor(max_workers=INDEX_READ_WORKERS) as executor:
+        queued = iter(pending)
+        in_flight = deque(
+            (file, mtime, executor.submit(_read_file, file))
+            for file, mtime in islice(queued, INDEX_READ_AHEAD)
+        )
+        while in_flight:
+            file, mtime, future = in_flight.popleft()
+            for next_file, next_mtime in islice(queued, 1):
+                in_flight.append((next_file, next_mtime, executor.submit(_read_file, next_file)))
+            content = future.result()
+            if content is None:
+                continue
+            content_sha1 = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            indexed_states.append((str(file), mtime, content_sha1))
+            state = states.get(str(file))
+            if state is not None and state[1] == content_sha1:
+                continue
+            replaced_paths.append(str(file))
+            chunks = embedder.chunk_text(
+                content, max_tokens=INDEX_CHUNK_TOKENS, overlap=INDEX_CHUNK_OVERLAP
+            )
+            for chunk_idx, chunk in enumerate(chunks):
+                items.append(
+                    AddItem(
+                        doc_id=f"{file}::{chunk_idx}",
+                        content=chunk,
+                        metadata={
+                            "path": str(file),
+                            "extension": file.suffix.lower(),
+                            "chunk": chunk_idx,
+                        },
+                    )
+                )
+                if len(items) == INDEX_ENCODE_CHUNK:
+                    count += _replace_files(replaced_paths, items)
+                    items = []
+                    replaced_paths = []
+    if items:
+        count += _replace_files(replaced_paths, items)
+    # Recorded only after every chunk is stored, so an interrupted run
+    # re-indexes the affected files next time.
+    vector_store.set_file_states(indexed_states)
+    return count
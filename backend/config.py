@@ -12,6 +12,10 @@ class Settings:
     ollama_url: str = os.getenv("OLLAMA_URL", "http://localhost:11434")
     ollama_model: str = os.getenv("OLLAMA_MODEL", "llama3.1")
     embedding_model_path: str | None = os.getenv("EMBEDDING_MODEL_PATH")
+    embedding_batch_size: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+    embedding_onnx: bool = os.getenv("EMBEDDING_ONNX", "1").lower() not in {"0", "false", "no"}
+    onnx_model_dir: str = os.getenv("ONNX_MODEL_DIR", "./data/onnx")
+    inference_concurrency: int = int(os.getenv("INFERENCE_CONCURRENCY", "1"))
     db_path: str = os.getenv("VECTOR_DB_PATH", "./data/embeddings.db")
     auto_index_path: str | None = os.getenv("AUTO_INDEX_PATH")
 
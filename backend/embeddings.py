@@ -1,41 +1,222 @@
 """Embedding utilities supporting offline models."""
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable
 import importlib.util
+import json
+import re
+import threading
 
 import numpy as np
 
 from config import settings
 
+torch = None
+if importlib.util.find_spec("torch"):
+    import torch  # type: ignore
+
 SentenceTransformer = None
 if importlib.util.find_spec("sentence_transformers"):
     from sentence_transformers import SentenceTransformer  # type: ignore
 
+ORTModelForFeatureExtraction = None
+if importlib.util.find_spec("optimum") and importlib.util.find_spec("onnxruntime"):
+    from huggingface_hub import hf_hub_download  # type: ignore
+    from huggingface_hub.utils import EntryNotFoundError, LocalEntryNotFoundError  # type: ignore
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+    from optimum.onnxruntime import ORTModelForFeatureExtraction  # type: ignore
+    from transformers import AutoTokenizer  # type: ignore
+
 HashingVectorizer = None
 if importlib.util.find_spec("sklearn.feature_extraction.text"):
     from sklearn.feature_extraction.text import HashingVectorizer  # type: ignore
+    from sklearn.preprocessing import normalize  # type: ignore
+
+
+_WORD_PATTERN = re.compile(r"\S+")
+# sentence-transformers pooling flags and the ONNXEmbedder mode reproducing each.
+_POOLING_MODES = {
+    "pooling_mode_mean_tokens": "mean",
+    "pooling_mode_cls_token": "cls",
+    "pooling_mode_max_tokens": "max",
+}
+# sentence-transformers module stacks the ONNX export reproduces: the
+# transformer, its pooling and an optional normalization.
+_ONNX_MODULE_STACKS = (["Transformer", "Pooling"], ["Transformer", "Pooling", "Normalize"])
+
+
+def _tokenizer_spans(tokenizer: Any, text: str) -> list[tuple[int, int]]:
+    """Return character offsets of each token produced by a HF tokenizer."""
+
+    encoding = tokenizer(
+        text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+    )
+    return [tuple(span) for span in encoding["offset_mapping"]]
 
 
 @dataclass
 class Embedder:
     """Wrapper for embedding generation with a consistent API."""
 
+    # HF fast tokenizers reconfigure truncation on every call and fail with
+    # "Already borrowed" when used from two threads, so chunking and encoding
+    # share one lock per embedder.
+    _tokenizer_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
     def encode(self, texts: Iterable[str]) -> np.ndarray:
         raise NotImplementedError
 
+    def token_spans(self, text: str) -> list[tuple[int, int]]:
+        """Return character offsets of the tokens the model would see."""
+
+        return [match.span() for match in _WORD_PATTERN.finditer(text)]
+
+    def text_token_limit(self, max_tokens: int) -> int:
+        """Return how many text tokens fit in an input of ``max_tokens`` tokens."""
+
+        return max_tokens
+
+    def chunk_text(self, text: str, max_tokens: int = 256, overlap: int = 32) -> list[str]:
+        """Split text into overlapping windows of at most ``max_tokens`` tokens."""
+
+        # Special tokens added at encode time share the model's input length.
+        max_tokens = max(self.text_token_limit(max_tokens), 1)
+        spans = self.token_spans(text)
+        if len(spans) <= max_tokens:
+            return [text]
+        step = max(max_tokens - overlap, 1)
+        chunks = []
+        for start in range(0, len(spans), step):
+            window = spans[start : start + max_tokens]
+            chunks.append(text[window[0][0] : window[-1][1]])
+            if start + max_tokens >= len(spans):
+                break
+        return chunks
+
 
 @dataclass
 class SentenceTransformerEmbedder(Embedder):
     """Embedder powered by a local sentence-transformers model."""
 
     model: SentenceTransformer
+    batch_size: int = 64
 
     def encode(self, texts: Iterable[str]) -> np.ndarray:
-        embeddings = self.model.encode(list(texts), show_progress_bar=False)
+        with self._tokenizer_lock:
+            embeddings = self.model.encode(
+                list(texts),
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
         return np.asarray(embeddings, dtype=np.float32)
 
+    def token_spans(self, text: str) -> list[tuple[int, int]]:
+        with self._tokenizer_lock:
+            return _tokenizer_spans(self.model.tokenizer, text)
+
+    def text_token_limit(self, max_tokens: int) -> int:
+        limit = min(max_tokens, self.model.max_seq_length)
+        return limit - self.model.tokenizer.num_special_tokens_to_add()
+
+
+@dataclass
+class CUDASentenceTransformerEmbedder(SentenceTransformerEmbedder):
+    """Sentence-transformers embedder that stages inputs in reused pinned buffers."""
+
+    _buffers: dict[str, Any] = field(default_factory=dict, init=False, repr=False)
+
+    def _stage(self, name: str, tensor: Any) -> Any:
+        """Copy a host tensor into its pinned buffer and start the device upload."""
+
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            buffer = torch.zeros(
+                (self.batch_size, self.model.max_seq_length), dtype=tensor.dtype, pin_memory=True
+            )
+            self._buffers[name] = buffer
+        staged = buffer[: tensor.shape[0]]
+        staged.copy_(tensor)
+        return staged.to(self.model.device, non_blocking=True)
+
+    def encode(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        batches = []
+        # The tokenizer lock also keeps the pinned buffers to one batch at a time.
+        with self._tokenizer_lock, torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                features = self.model.tokenizer(
+                    texts[start : start + self.batch_size],
+                    padding="max_length",
+                    truncation=True,
+                    max_length=self.model.max_seq_length,
+                    return_tensors="pt",
+                )
+                inputs = {name: self._stage(name, tensor) for name, tensor in features.items()}
+                embeddings = self.model(inputs)["sentence_embedding"].float()
+                embeddings = torch.nn.functional.normalize(embeddings, dim=1)
+                # The blocking device-to-host copy also guarantees the uploads
+                # finished before the buffers are reused for the next batch.
+                batches.append(embeddings.cpu().numpy())
+        if not batches:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.vstack(batches).astype(np.float32, copy=False)
+
+
+@dataclass
+class ONNXEmbedder(Embedder):
+    """Embedder running an INT8-quantized ONNX export on the CPU."""
+
+    model: ORTModelForFeatureExtraction
+    tokenizer: Any
+    batch_size: int = 64
+    max_length: int = 256
+    pooling: str = "mean"
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Reduce token states to one vector per text like the model's pooling module."""
+
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = attention_mask[..., None].astype(bool)
+        if self.pooling == "max":
+            return np.where(mask, hidden, -np.inf).max(axis=1)
+        mask = mask.astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            with self._tokenizer_lock:
+                inputs = self.tokenizer(
+                    texts[start : start + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="np",
+                )
+            hidden = self.model(**inputs).last_hidden_state
+            pooled = self._pool(hidden, inputs["attention_mask"])
+            batches.append(pooled.astype(np.float32))
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = np.vstack(batches)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def token_spans(self, text: str) -> list[tuple[int, int]]:
+        with self._tokenizer_lock:
+            return _tokenizer_spans(self.tokenizer, text)
+
+    def text_token_limit(self, max_tokens: int) -> int:
+        limit = min(max_tokens, self.max_length)
+        return limit - self.tokenizer.num_special_tokens_to_add()
+
 
 @dataclass
 class HashingEmbedder(Embedder):
@@ -44,25 +225,126 @@ class HashingEmbedder(Embedder):
     vectorizer: HashingVectorizer
 
     def encode(self, texts: Iterable[str]) -> np.ndarray:
-        matrix = self.vectorizer.transform(list(texts))
-        dense = matrix.toarray().astype(np.float32)
-        norms = np.linalg.norm(dense, axis=1, keepdims=True)
-        norms[norms == 0] = 1.0
-        return dense / norms
+        # Normalize while still sparse so only the final result is densified.
+        matrix = normalize(self.vectorizer.transform(list(texts)), norm="l2", copy=False)
+        return matrix.toarray().astype(np.float32, copy=False)
+
+
+def _model_file(model_name: str, filename: str) -> Path | None:
+    """Locate a file of a local or hub model, returning None if it has none.
+
+    Raises OSError when that cannot be determined, e.g. offline with the
+    file not cached.
+    """
+
+    if Path(model_name).is_dir():
+        path = Path(model_name) / filename
+        return path if path.exists() else None
+    try:
+        return Path(hf_hub_download(model_name, filename))
+    except LocalEntryNotFoundError:
+        raise
+    except EntryNotFoundError:
+        return None
+
+
+def _read_pooling_mode(model_name: str) -> str | None:
+    """Return the ONNXEmbedder pooling matching a model, or None if unsupported."""
+
+    try:
+        modules_path = _model_file(model_name, "modules.json")
+        if modules_path is None:
+            # Plain transformers checkpoints are mean-pooled by sentence-transformers.
+            return "mean"
+        modules = json.loads(modules_path.read_text(encoding="utf-8"))
+        if [module["type"].rsplit(".", 1)[-1] for module in modules] not in _ONNX_MODULE_STACKS:
+            return None
+        config_path = _model_file(model_name, f"{modules[1]['path']}/config.json")
+    except (OSError, ValueError):
+        return None
+    if config_path is None:
+        return None
+    config = json.loads(config_path.read_text(encoding="utf-8"))
+    enabled = [key for key, value in config.items() if key.startswith("pooling_mode") and value]
+    if len(enabled) != 1:
+        return None
+    return _POOLING_MODES.get(enabled[0])
+
+
+def _load_onnx_embedder(model_name: str) -> ONNXEmbedder | None:
+    """Export a model to ONNX once, quantize it to INT8, and load it.
+
+    Returns None when the model's modules cannot be reproduced on the ONNX
+    outputs or the export fails, so the caller falls back to
+    sentence-transformers.
+    """
+
+    export_dir = Path(settings.onnx_model_dir) / model_name.strip("/").replace("/", "--")
+    quantized_name = "model_quantized.onnx"
+    # The pooling mode is cached with the export so an offline copy of the
+    # folder does not need the original model to load.
+    pooling_path = export_dir / "pooling.json"
+    if pooling_path.exists():
+        pooling = json.loads(pooling_path.read_text(encoding="utf-8"))["mode"]
+    else:
+        pooling = _read_pooling_mode(model_name)
+    if pooling is None:
+        return None
+    if not (export_dir / quantized_name).exists():
+        try:
+            model = ORTModelForFeatureExtraction.from_pretrained(
+                model_name, export=True, provider="CPUExecutionProvider"
+            )
+            model.save_pretrained(export_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+            quantize_dynamic(
+                export_dir / "model.onnx",
+                export_dir / quantized_name,
+                weight_type=QuantType.QInt8,
+            )
+        except Exception:
+            # optimum and onnxruntime raise many error types for models they
+            # cannot export or quantize; none of them should block startup.
+            return None
+    if not pooling_path.exists():
+        pooling_path.write_text(json.dumps({"mode": pooling}), encoding="utf-8")
+    model = ORTModelForFeatureExtraction.from_pretrained(
+        export_dir, file_name=quantized_name, provider="CPUExecutionProvider"
+    )
+    tokenizer = AutoTokenizer.from_pretrained(export_dir)
+    return ONNXEmbedder(
+        model=model,
+        tokenizer=tokenizer,
+        batch_size=settings.embedding_batch_size,
+        pooling=pooling,
+    )
 
 
 def get_embedder() -> Embedder:
     """Return the best available embedder for the current environment."""
 
+    model_name = settings.embedding_model_path or "sentence-transformers/all-MiniLM-L6-v2"
+    device = "cuda" if torch is not None and torch.cuda.is_available() else "cpu"
+    if device == "cpu" and settings.embedding_onnx and ORTModelForFeatureExtraction is not None:
+        embedder = _load_onnx_embedder(model_name)
+        if embedder is not None:
+            return embedder
+
     if SentenceTransformer is not None:
-        model_name = settings.embedding_model_path or "sentence-transformers/all-MiniLM-L6-v2"
-        model = SentenceTransformer(model_name)
-        return SentenceTransformerEmbedder(model=model)
+        model = SentenceTransformer(model_name, device=device)
+        if device == "cuda":
+            model.half()
+            return CUDASentenceTransformerEmbedder(
+                model=model, batch_size=settings.embedding_batch_size
+            )
+        return SentenceTransformerEmbedder(model=model, batch_size=settings.embedding_batch_size)
 
     if HashingVectorizer is None:
         raise RuntimeError(
             "No embedding backend available. Install sentence-transformers or scikit-learn."
         )
 
-    vectorizer = HashingVectorizer(n_features=512, alternate_sign=False, norm=None)
+    vectorizer = HashingVectorizer(
+        n_features=512, alternate_sign=False, norm=None, dtype=np.float32
+    )
     return HashingEmbedder(vectorizer=vectorizer)
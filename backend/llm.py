@@ -1,19 +1,47 @@
 """Local LLM integration via Ollama."""
 from __future__ import annotations
 
-import requests
+import json
+from typing import AsyncIterator
+
+import httpx
 
 from config import settings
 
+# A shared client keeps connections to Ollama alive between requests.
+_client = httpx.AsyncClient(
+    timeout=120,
+    limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+)
 
-def generate_completion(prompt: str) -> str:
-    """Send a prompt to the local Ollama server and return the response."""
 
-    response = requests.post(
+async def stream_completion(prompt: str) -> AsyncIterator[str]:
+    """Send a prompt to the local Ollama server and yield tokens as they arrive."""
+
+    async with _client.stream(
+        "POST",
         f"{settings.ollama_url}/api/generate",
-        json={"model": settings.ollama_model, "prompt": prompt, "stream": False},
-        timeout=120,
-    )
-    response.raise_for_status()
-    payload = response.json()
-    return payload.get("response", "")
+        json={"model": settings.ollama_model, "prompt": prompt, "stream": True},
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            payload = json.loads(line)
+            token = payload.get("response", "")
+            if token:
+                yield token
+            if payload.get("done"):
+                break
+
+
+async def generate_completion(prompt: str) -> str:
+    """Send a prompt to the local Ollama server and return the response."""
+
+    return "".join([token async for token in stream_completion(prompt)])
+
+
+async def close_client() -> None:
+    """Close pooled connections to the Ollama server."""
+
+    await _client.aclose()
@@ -1,14 +1,56 @@
 """SQLite-backed vector store for offline embeddings."""
 from __future__ import annotations
 
+import importlib.util
 import json
+import math
 import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import numpy as np
 
+faiss = None
+if importlib.util.find_spec("faiss"):
+    import faiss  # type: ignore
+
+numba = None
+if importlib.util.find_spec("numba"):
+    import numba  # type: ignore
+
+# Below IVF_MIN_VECTORS an exact flat index is both faster and more accurate
+# than probing inverted lists; PQ codes only pay off once the corpus is large
+# enough to train their codebooks.
+IVF_MIN_VECTORS = 1_000
+IVFPQ_MIN_VECTORS = 10_000
+IVF_NPROBE = 8
+# An IVF index is retrained once the corpus outgrows nlist**2 by this factor,
+# i.e. when sqrt(N) has doubled since the coarse centroids were trained.
+IVF_REBUILD_GROWTH = 4
+SQL_BATCH_SIZE = 500
+# Rows written per upsert transaction; bounds how large the WAL can grow.
+UPSERT_BATCH_SIZE = 10_000
+MIN_VECTOR_CAPACITY = 1024
+# Minimum seconds between rewrites of the persisted FAISS index; close()
+# always writes pending changes.
+INDEX_PERSIST_INTERVAL = 60.0
+# Rows dequantized per step of the fallback scan; small enough that the
+# float32 block stays cache-resident.
+SCAN_BLOCK_ROWS = 4096
+# WAL lets readers proceed while a writer commits; the cache and mmap sizes
+# keep the hot pages of the documents table in memory.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-262144",
+    "PRAGMA mmap_size=1073741824",
+    "PRAGMA temp_store=MEMORY",
+)
+
 
 @dataclass
 class Document:
@@ -20,103 +62,709 @@ class Document:
     embedding: np.ndarray
 
 
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of an embedding matrix."""
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def _normalize_query(query_embedding: np.ndarray) -> np.ndarray:
+    """Flatten a query embedding to a unit-length float32 vector."""
+
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    return query / max(float(np.linalg.norm(query)), 1e-12)
+
+
+def quantize_int8(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Quantize each row symmetrically to int8, returning codes and row scales."""
+
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Reconstruct float32 rows from int8 codes and their scales."""
+
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def _scan_numpy(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Score int8 rows against a query, dequantizing one block at a time."""
+
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+        stop = min(start + SCAN_BLOCK_ROWS, len(codes))
+        scores[start:stop] = codes[start:stop].astype(np.float32) @ query
+    scores *= scales
+    return scores
+
+
+_scan_rows = _scan_numpy
+if numba is not None:
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _scan_numba(codes, scales, query):
+        count, dim = codes.shape
+        scores = np.empty(count, dtype=np.float32)
+        for row in numba.prange(count):
+            total = np.float32(0.0)
+            for col in range(dim):
+                total += codes[row, col] * query[col]
+            scores[row] = total * scales[row]
+        return scores
+
+    _scan_rows = _scan_numba
+
+
+def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Return indices of the ``top_k`` highest scores, best first, in O(N)."""
+
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k == len(scores):
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, top_k - 1)[:top_k]
+    return part[np.argsort(-scores[part])]
+
+
+def _index_kind(count: int, dim: int) -> str:
+    """Pick the FAISS index family suited to a corpus of ``count`` vectors."""
+
+    if count < IVF_MIN_VECTORS:
+        return "flat"
+    if count >= IVFPQ_MIN_VECTORS and dim % 8 == 0:
+        return "ivfpq"
+    return "ivfflat"
+
+
+def _faiss_index_kind(index) -> str:
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfflat"
+    return "flat"
+
+
+def _index_is_stale(index, count: int) -> bool:
+    """Return True when ``index`` no longer fits a corpus of ``count`` vectors."""
+
+    if _faiss_index_kind(index) != _index_kind(count, index.d):
+        return True
+    return isinstance(index, faiss.IndexIVF) and count > IVF_REBUILD_GROWTH * index.nlist**2
+
+
+def _build_faiss_index(dim: int, embeddings: np.ndarray, ids: np.ndarray):
+    """Build an inner-product FAISS index sized for the given corpus."""
+
+    count = len(ids)
+    kind = _index_kind(count, dim)
+    if kind == "flat":
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+    else:
+        nlist = int(math.sqrt(count))
+        quantizer = faiss.IndexFlatIP(dim)
+        if kind == "ivfpq":
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, nlist, dim // 8, 8, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.nprobe = IVF_NPROBE
+    if count:
+        index.add_with_ids(embeddings, ids)
+    return index
+
+
 class VectorStore:
-    """A lightweight vector database built on SQLite."""
+    """A lightweight vector database built on SQLite.
+
+    Document text and metadata live in SQLite and are mirrored in memory as
+    parallel per-row lists; normalized embeddings are quantized to int8 and
+    live in a memory-mapped file next to the database, addressed by
+    ``row_idx``, with each row's scale kept in SQLite.
+    """
 
     def __init__(self, db_path: str) -> None:
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.db_path = db_path
+        self.index_path = f"{db_path}.faiss"
+        self.vectors_path = f"{db_path}.i8"
+        self.index = None
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+        # Set when the index no longer fits the corpus; _refresh_index builds a
+        # replacement outside the lock while _rebuild_rows records the rows
+        # written in the meantime.
+        self._index_stale = False
+        self._rebuild_rows: set[int] | None = None
+        self._lock = threading.RLock()
+        # Rows freed by deletes hold None in the lists until an upsert reuses them.
+        self._ids: list[str | None] = []
+        self._contents: list[str | None] = []
+        self._metadata: list[dict | None] = []
+        self._free_rows: set[int] = set()
+        self._vectors: np.memmap | None = None
+        self._scales = np.empty(0, dtype=np.float32)
+        self._dim: int | None = None
+        self._size = 0
+        self._conn = self._connect()
         self._init_db()
+        self._open_vectors()
+        self._load_rows()
+        if faiss is not None:
+            self._load_index()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the database with the tuned pragmas applied."""
+
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements on the shared connection inside one write transaction."""
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def flush(self) -> None:
+        """Flush the vectors file and persist the FAISS index if it changed."""
+
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            if self._index_dirty and self.index is not None:
+                tmp_path = f"{self.index_path}.tmp"
+                faiss.write_index(self.index, tmp_path)
+                os.replace(tmp_path, self.index_path)
+                self._index_dirty = False
+                self._index_saved_at = time.monotonic()
+
+    def _persist_index_if_due(self) -> None:
+        """Flush a changed index once INDEX_PERSIST_INTERVAL has passed since the last write."""
+
+        if self._index_dirty and time.monotonic() - self._index_saved_at >= INDEX_PERSIST_INTERVAL:
+            self.flush()
+
+    def close(self) -> None:
+        """Persist pending changes and close the database connection."""
+
+        with self._lock:
+            self.flush()
+            self._conn.close()
 
     def _init_db(self) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL NOT NULL,
+                    content_sha1 TEXT NOT NULL
+                )
+                """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+            if "embedding" in columns:
+                self._migrate_blob_embeddings(conn)
+                return
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS documents (
                     doc_id TEXT PRIMARY KEY,
                     content TEXT NOT NULL,
                     metadata TEXT NOT NULL,
-                    embedding BLOB NOT NULL,
-                    embedding_dim INTEGER NOT NULL
+                    row_idx INTEGER NOT NULL UNIQUE,
+                    embedding_dim INTEGER NOT NULL,
+                    scale REAL NOT NULL
+                )
+                """
+            )
+
+    def _migrate_blob_embeddings(self, conn: sqlite3.Connection) -> None:
+        """Move embeddings stored as per-row BLOBs into the vectors file."""
+
+        rows = conn.execute(
+            "SELECT doc_id, content, metadata, embedding, embedding_dim FROM documents ORDER BY rowid"
+        ).fetchall()
+        if os.path.exists(self.vectors_path):
+            os.remove(self.vectors_path)
+        scales = np.empty(0, dtype=np.float32)
+        if rows:
+            # One join and one frombuffer instead of an array per row.
+            blob = b"".join(row[3] for row in rows)
+            embeddings = _normalize(
+                np.frombuffer(blob, dtype=np.float32).reshape(len(rows), rows[0][4])
+            )
+            codes, scales = quantize_int8(embeddings)
+            self._grow_vectors(len(rows), embeddings.shape[1])
+            self._vectors[: len(rows)] = codes
+            self._scales[: len(rows)] = scales
+            self._vectors.flush()
+            self._dim = embeddings.shape[1]
+            self._size = len(rows)
+        conn.execute("ALTER TABLE documents RENAME TO documents_blob")
+        conn.execute(
+            """
+            CREATE TABLE documents (
+                doc_id TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                row_idx INTEGER NOT NULL UNIQUE,
+                embedding_dim INTEGER NOT NULL,
+                scale REAL NOT NULL
+            )
+            """
+        )
+        conn.executemany(
+            """
+            INSERT INTO documents (doc_id, content, metadata, row_idx, embedding_dim, scale)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (doc_id, content, metadata, row_idx, dim, float(scale))
+                for row_idx, ((doc_id, content, metadata, _, dim), scale) in enumerate(
+                    zip(rows, scales)
                 )
+            ],
+        )
+        conn.execute("DROP TABLE documents_blob")
+        # FAISS ids were SQLite rowids before the migration; rebuild from row_idx.
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def _open_vectors(self) -> None:
+        """Map the vectors file for the rows already recorded in SQLite."""
+
+        if self._vectors is not None:
+            return
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(row_idx) + 1, MAX(embedding_dim) FROM documents"
+            ).fetchone()
+        if row[0] is None:
+            return
+        if not os.path.exists(self.vectors_path):
+            raise RuntimeError(
+                f"Vector file {self.vectors_path} is missing for database {self.db_path}."
+            )
+        self._size, self._dim = row
+        capacity = os.path.getsize(self.vectors_path) // self._dim
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.int8, mode="r+", shape=(capacity, self._dim)
+        )
+        self._scales = np.ones(capacity, dtype=np.float32)
+        with self._lock:
+            rows = self._conn.execute("SELECT row_idx, scale FROM documents").fetchall()
+        stored = np.array(rows, dtype=np.float64).reshape(-1, 2)
+        self._scales[stored[:, 0].astype(np.int64)] = stored[:, 1]
+
+    def _grow_vectors(self, needed: int, dim: int) -> None:
+        """Extend the vectors file and scales in amortized doubling steps."""
+
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, MIN_VECTOR_CAPACITY)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vectors_path, "ab"):
+            pass
+        os.truncate(self.vectors_path, capacity * dim)
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.int8, mode="r+", shape=(capacity, dim)
+        )
+        scales = np.ones(capacity, dtype=np.float32)
+        scales[: len(self._scales)] = self._scales
+        self._scales = scales
+
+    def _load_index(self) -> None:
+        """Load the persisted FAISS index, rebuilding it from the vectors if stale."""
+
+        if os.path.exists(self.index_path):
+            index = faiss.read_index(self.index_path)
+            live = self._live_count()
+            if index.ntotal == live and not _index_is_stale(index, live):
+                if isinstance(index, faiss.IndexIVF):
+                    index.nprobe = IVF_NPROBE
+                self.index = index
+                return
+        if self._size:
+            self._index_stale = True
+            self._refresh_index()
+            self.flush()
+
+    def _refresh_index(self) -> None:
+        """Replace a stale FAISS index with one trained on the current corpus.
+
+        Training runs on a snapshot without holding the lock, so searches keep
+        using the previous index (or the scan) meanwhile; rows written during
+        the build are replayed into the new index before it is swapped in.
+        """
+
+        with self._lock:
+            if not self._index_stale or self._rebuild_rows is not None:
+                return
+            self._index_stale = False
+            ids = np.array(
+                [row_idx for row_idx in range(self._size) if row_idx not in self._free_rows],
+                dtype=np.int64,
+            )
+            if not len(ids):
+                self.index = None
+                self._mark_index_dirty()
+                return
+            codes = self._vectors[ids]
+            scales = self._scales[ids]
+            dim = self._dim
+            self._rebuild_rows = set()
+        try:
+            index = _build_faiss_index(dim, dequantize_int8(codes, scales), ids)
+        except BaseException:
+            with self._lock:
+                self._rebuild_rows = None
+                self._index_stale = True
+            raise
+        with self._lock:
+            changed = np.array(sorted(self._rebuild_rows), dtype=np.int64)
+            self._rebuild_rows = None
+            if len(changed):
+                index.remove_ids(changed)
+                live = np.array(
+                    [row_idx for row_idx in changed.tolist() if row_idx not in self._free_rows],
+                    dtype=np.int64,
+                )
+                if len(live):
+                    embeddings = dequantize_int8(self._vectors[live], self._scales[live])
+                    index.add_with_ids(embeddings, live)
+            self.index = index
+            self._index_stale = _index_is_stale(index, self._live_count())
+            self._mark_index_dirty()
+
+    def _mark_index_dirty(self) -> None:
+        """Flag the in-memory index as ahead of the persisted copy.
+
+        The stale file is removed straight away so a crash before the next
+        ``flush`` forces a rebuild instead of loading outdated vectors.
+        """
+
+        if not self._index_dirty and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        self._index_dirty = True
+
+    def _live_count(self) -> int:
+        return self._size - len(self._free_rows)
+
+    def _load_rows(self) -> None:
+        """Cache document ids, text and metadata as parallel lists in row order."""
+
+        self._ids = [None] * self._size
+        self._contents = [None] * self._size
+        self._metadata = [None] * self._size
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_idx, doc_id, content, metadata FROM documents"
+            ).fetchall()
+        for row_idx, doc_id, content, metadata_json in rows:
+            self._ids[row_idx] = doc_id
+            self._contents[row_idx] = content
+            self._metadata[row_idx] = json.loads(metadata_json)
+        self._free_rows = {row_idx for row_idx, doc_id in enumerate(self._ids) if doc_id is None}
+
+    def _update_rows(self, documents: list[Document], row_indices: dict[str, int]) -> None:
+        """Mirror upserted documents into the in-memory row lists."""
+
+        missing = self._size - len(self._ids)
+        self._ids.extend([None] * missing)
+        self._contents.extend([None] * missing)
+        self._metadata.extend([None] * missing)
+        for doc in documents:
+            row_idx = row_indices[doc.doc_id]
+            self._ids[row_idx] = doc.doc_id
+            self._contents[row_idx] = doc.content
+            self._metadata[row_idx] = doc.metadata
+
+    def _drop_rows(self, row_indices: list[int]) -> None:
+        """Free the rows of deleted documents in memory and in the FAISS index."""
+
+        for row_idx in row_indices:
+            self._ids[row_idx] = None
+            self._contents[row_idx] = None
+            self._metadata[row_idx] = None
+        self._free_rows.update(row_indices)
+        if self._rebuild_rows is not None:
+            self._rebuild_rows.update(row_indices)
+        if self.index is not None and row_indices:
+            self.index.remove_ids(np.array(sorted(row_indices), dtype=np.int64))
+            self._mark_index_dirty()
+            self._index_stale = _index_is_stale(self.index, self._live_count())
+
+    def _fetch_row_indices(self, conn: sqlite3.Connection, doc_ids: list[str]) -> dict[str, int]:
+        row_indices: dict[str, int] = {}
+        for start in range(0, len(doc_ids), SQL_BATCH_SIZE):
+            batch = doc_ids[start : start + SQL_BATCH_SIZE]
+            placeholders = ", ".join("?" for _ in batch)
+            row_indices.update(
+                conn.execute(
+                    f"SELECT doc_id, row_idx FROM documents WHERE doc_id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+            )
+        return row_indices
+
+    def get_file_states(self, paths: list[str]) -> dict[str, tuple[float, str]]:
+        """Return the recorded ``(mtime, content_sha1)`` of each indexed path."""
+
+        states: dict[str, tuple[float, str]] = {}
+        with self._lock:
+            for start in range(0, len(paths), SQL_BATCH_SIZE):
+                batch = paths[start : start + SQL_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT path, mtime, content_sha1 FROM files WHERE path IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                states.update((path, (mtime, sha1)) for path, mtime, sha1 in rows)
+        return states
+
+    def get_file_paths(self, prefix: str = "") -> list[str]:
+        """Return the indexed file paths that start with ``prefix``."""
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE substr(path, 1, length(?)) = ?", (prefix, prefix)
+            ).fetchall()
+        return [path for (path,) in rows]
+
+    def set_file_states(self, states: Iterable[tuple[str, float, str]]) -> None:
+        """Record ``(path, mtime, content_sha1)`` for files that were indexed."""
+
+        with self._transaction() as conn:
+            conn.executemany(
                 """
+                INSERT INTO files (path, mtime, content_sha1) VALUES (?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    mtime=excluded.mtime,
+                    content_sha1=excluded.content_sha1
+                """,
+                states,
             )
-            conn.commit()
 
     def upsert_documents(self, documents: Iterable[Document]) -> int:
         """Insert or replace documents in the store."""
 
-        rows = []
-        for doc in documents:
-            embedding = np.asarray(doc.embedding, dtype=np.float32)
-            rows.append(
-                (
-                    doc.doc_id,
-                    doc.content,
-                    json.dumps(doc.metadata),
-                    embedding.tobytes(),
-                    embedding.shape[-1],
-                )
+        documents = list(documents)
+        if not documents:
+            return 0
+        # Store unit vectors so search never has to recompute corpus norms.
+        embeddings = _normalize(
+            np.stack([np.asarray(doc.embedding, dtype=np.float32).reshape(-1) for doc in documents])
+        )
+        dim = embeddings.shape[1]
+        if self._dim is not None and dim != self._dim:
+            raise ValueError(
+                f"Embedding dimension {dim} does not match the store dimension {self._dim}."
             )
-        with sqlite3.connect(self.db_path) as conn:
+        codes, scales = quantize_int8(embeddings)
+        with self._lock:
+            for start in range(0, len(documents), UPSERT_BATCH_SIZE):
+                stop = start + UPSERT_BATCH_SIZE
+                self._upsert_batch(documents[start:stop], codes[start:stop], scales[start:stop], dim)
+        if faiss is not None:
+            self._refresh_index()
+            self._persist_index_if_due()
+        return len(documents)
+
+    def _upsert_batch(
+        self, documents: list[Document], codes: np.ndarray, scales: np.ndarray, dim: int
+    ) -> None:
+        """Write one batch of quantized documents inside a single transaction."""
+
+        # Serialize metadata before anything is written so a bad row cannot
+        # leave the vectors file out of step with SQLite.
+        metadata_json = [json.dumps(doc.metadata) for doc in documents]
+        with self._transaction() as conn:
+            row_indices = self._fetch_row_indices(conn, [doc.doc_id for doc in documents])
+            size = self._size
+            free_rows = iter(sorted(self._free_rows))
+            for doc in documents:
+                if doc.doc_id not in row_indices:
+                    row_idx = next(free_rows, None)
+                    if row_idx is None:
+                        row_idx = size
+                        size += 1
+                    row_indices[doc.doc_id] = row_idx
+            positions = np.array([row_indices[doc.doc_id] for doc in documents], dtype=np.int64)
             conn.executemany(
                 """
-                INSERT INTO documents (doc_id, content, metadata, embedding, embedding_dim)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO documents (doc_id, content, metadata, row_idx, embedding_dim, scale)
+                VALUES (?, ?, ?, ?, ?, ?)
                 ON CONFLICT(doc_id) DO UPDATE SET
                     content=excluded.content,
                     metadata=excluded.metadata,
-                    embedding=excluded.embedding,
-                    embedding_dim=excluded.embedding_dim
+                    embedding_dim=excluded.embedding_dim,
+                    scale=excluded.scale
                 """,
-                rows,
+                [
+                    (doc.doc_id, doc.content, metadata, int(row_idx), dim, float(scale))
+                    for doc, metadata, row_idx, scale in zip(
+                        documents, metadata_json, positions, scales
+                    )
+                ],
             )
-            conn.commit()
-        return len(rows)
+            # Growing only appends zeroed rows, so it is safe to undo by rollback.
+            self._grow_vectors(size, dim)
+        # Existing codes are overwritten only once the rows are committed.
+        self._vectors[positions] = codes
+        self._scales[positions] = scales
+        self._vectors.flush()
+        # Rows that were live before this batch must leave the index first.
+        replaced = np.array(
+            [
+                row_idx
+                for row_idx in positions.tolist()
+                if row_idx < self._size and row_idx not in self._free_rows
+            ],
+            dtype=np.int64,
+        )
+        self._free_rows.difference_update(positions.tolist())
+        self._dim = dim
+        self._size = size
+        self._update_rows(documents, row_indices)
+        if faiss is not None:
+            self._update_index(positions, replaced)
+
+    def _update_index(self, positions: np.ndarray, replaced: np.ndarray) -> None:
+        """Mirror upserted rows into the in-memory FAISS index.
+
+        The index is persisted at most every INDEX_PERSIST_INTERVAL; only rows
+        that already existed are removed before the new vectors are added.
+        An index that outgrew its layout keeps serving until ``_refresh_index``
+        swaps in its replacement.
+        """
+
+        if self._rebuild_rows is not None:
+            self._rebuild_rows.update(positions.tolist())
+        if self.index is None or _index_is_stale(self.index, self._live_count()):
+            self._index_stale = True
+        if self.index is None:
+            return
+        ids = np.unique(positions)
+        if len(replaced):
+            self.index.remove_ids(np.unique(replaced))
+        self.index.add_with_ids(dequantize_int8(self._vectors[ids], self._scales[ids]), ids)
+        self._mark_index_dirty()
+
+    def delete_by_path(self, paths: Iterable[str]) -> int:
+        """Remove every document indexed from the given files, and their file states.
+
+        Matches the ``<path>::<chunk>`` ids written by folder indexing as well
+        as documents stored under the bare path.
+        """
+
+        paths = list(paths)
+        with self._lock:
+            with self._transaction() as conn:
+                row_indices: dict[str, int] = {}
+                for path in paths:
+                    # "::" sorts just before ":;", so the range covers the chunk ids.
+                    row_indices.update(
+                        conn.execute(
+                            """
+                            SELECT doc_id, row_idx FROM documents
+                            WHERE doc_id = ? OR (doc_id >= ? AND doc_id < ?)
+                            """,
+                            (path, f"{path}::", f"{path}:;"),
+                        ).fetchall()
+                    )
+                conn.executemany(
+                    "DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in row_indices]
+                )
+                conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+            self._drop_rows(list(row_indices.values()))
+        if faiss is not None:
+            self._refresh_index()
+            self._persist_index_if_due()
+        return len(row_indices)
 
     def get_all_documents(self) -> list[Document]:
         """Return all documents stored in the database."""
 
-        with sqlite3.connect(self.db_path) as conn:
-            rows = conn.execute(
-                "SELECT doc_id, content, metadata, embedding, embedding_dim FROM documents"
-            ).fetchall()
-        documents = []
-        for doc_id, content, metadata_json, embedding_blob, embedding_dim in rows:
-            embedding = np.frombuffer(embedding_blob, dtype=np.float32).reshape(-1, embedding_dim)
-            documents.append(
+        with self._lock:
+            if not self._size:
+                return []
+            embeddings = dequantize_int8(self._vectors[: self._size], self._scales[: self._size])
+            return [
                 Document(
-                    doc_id=doc_id,
-                    content=content,
-                    metadata=json.loads(metadata_json),
-                    embedding=embedding[0],
+                    doc_id=self._ids[idx],
+                    content=self._contents[idx],
+                    metadata=self._metadata[idx],
+                    embedding=embeddings[idx],
                 )
-            )
-        return documents
+                for idx in range(self._size)
+                if self._ids[idx] is not None
+            ]
 
     def search(self, query_embedding: np.ndarray, top_k: int = 5) -> list[dict]:
         """Return top-k similar documents using cosine similarity."""
 
-        docs = self.get_all_documents()
-        if not docs:
+        if top_k <= 0:
             return []
-        embeddings = np.stack([doc.embedding for doc in docs])
-        query = query_embedding.astype(np.float32)
-        if query.ndim == 2:
-            query = query[0]
-        denom = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
-        denom[denom == 0] = 1.0
-        scores = (embeddings @ query) / denom
-        top_indices = np.argsort(scores)[::-1][:top_k]
-        results = []
-        for idx in top_indices:
-            doc = docs[idx]
-            results.append(
-                {
-                    "id": doc.doc_id,
-                    "content": doc.content,
-                    "metadata": doc.metadata,
-                    "score": float(scores[idx]),
-                }
-            )
-        return results
+        with self._lock:
+            if self.index is not None:
+                return self._search_index(query_embedding, top_k)
+            live = self._live_count()
+            if not live:
+                return []
+            scores = self._scan(_normalize_query(query_embedding))
+            if self._free_rows:
+                scores[np.fromiter(self._free_rows, dtype=np.int64)] = -np.inf
+            top_indices = _top_k_indices(scores, min(top_k, live))
+            return [self._result(idx, float(scores[idx])) for idx in top_indices]
+
+    def _result(self, row_idx: int, score: float) -> dict:
+        """Build a search hit from the row lists."""
+
+        return {
+            "id": self._ids[row_idx],
+            "content": self._contents[row_idx],
+            "metadata": self._metadata[row_idx],
+            "score": score,
+        }
+
+    def _scan(self, query: np.ndarray) -> np.ndarray:
+        """Score every stored row against a unit query, reading int8 codes."""
+
+        codes = np.asarray(self._vectors[: self._size])
+        return _scan_rows(codes, self._scales[: self._size], query)
+
+    def _search_index(self, query_embedding: np.ndarray, top_k: int) -> list[dict]:
+        """Search the FAISS index and hydrate hits from the row lists."""
+
+        # FAISS allocates all k result slots up front, so never ask for more
+        # hits than the index holds.
+        top_k = min(top_k, self.index.ntotal)
+        if not top_k:
+            return []
+        query = _normalize_query(query_embedding)
+        scores, ids = self.index.search(query[None, :], top_k)
+        return [
+            self._result(int(row_idx), float(score))
+            for row_idx, score in zip(ids[0], scores[0])
+            if row_idx != -1
+        ]